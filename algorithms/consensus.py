@@ -2,12 +2,23 @@
 Main consensus algorithm: Finds the best trip for the group.
 """
 
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import random
+from statistics import median as _median
 import numpy as np
 from algorithms.scoring import (
+    build_group_context,
     rank_cities_for_group,
     calculate_group_compatibility,
-    calculate_individual_satisfaction
+    calculate_individual_satisfaction,
+    most_common_accommodation
 )
+from algorithms.regions import get_region_soa
+from algorithms.optimizer import optimize_route, create_travel_plan
+from generators.itinerary import generate_full_trip_itinerary, combine_group_preferences
+
+# Longest we wait for Gemini's detailed itinerary before returning without it
+ITINERARY_TIMEOUT_SECONDS = 180
 
 
 def select_region(users_data, regions_data):
@@ -52,7 +63,7 @@ def select_region(users_data, regions_data):
     return selected_region, region_cities
 
 
-def allocate_days_to_cities(selected_cities, total_days, cities_database):
+def allocate_days_to_cities(selected_cities, total_days, region_soa):
     """
     Decide how many days to spend in each city.
     """
@@ -63,10 +74,7 @@ def allocate_days_to_cities(selected_cities, total_days, cities_database):
     if available_days < 1:
         return {city: 1 for city in selected_cities}
 
-    typical_days = []
-    for city in selected_cities:
-        city_data = cities_database.get(city, {})
-        typical_days.append(city_data.get('typical_days', 2))
+    typical_days = region_soa.typical_days[region_soa.indices(selected_cities)].tolist()
 
     total_typical = sum(typical_days)
     allocation = {}
@@ -82,26 +90,59 @@ def allocate_days_to_cities(selected_cities, total_days, cities_database):
     return allocation
 
 
+def _build_option(option_spec, city_scores, avg_duration, users_data, region_soa, group_ctx):
+    """
+    Turn one option's chosen cities into a full option dict.
+
+    option_spec: (option_id, name, description, cities)
+
+    Only reads its arguments, so several options can be built concurrently.
+    """
+    option_id, name, description, cities_raw = option_spec
+
+    cities, distance, segment_distances = optimize_route(cities_raw, region_soa)
+    allocation = allocate_days_to_cities(cities, avg_duration, region_soa)
+    option_scores = city_scores[region_soa.indices(cities)].tolist()
+
+    return {
+        "option_id": option_id,
+        "name": name,
+        "description": description,
+        "cities": cities,
+        "day_allocation": allocation,
+        "total_days": avg_duration,
+        "total_distance_km": distance,
+        "travel_plan": create_travel_plan(cities, segment_distances),
+        "estimated_cost_per_person": estimate_trip_cost(
+            users_data, cities, allocation, region_soa, group_ctx.accommodation
+        ),
+        "group_score": round(sum(option_scores) / len(option_scores), 1),
+        "individual_scores": calculate_individual_satisfaction(group_ctx, cities, region_soa),
+        "votes": 0
+    }
+
+
 def generate_itinerary_options(users_data, regions_data):
     """
     Main algorithm: Generate 2–3 itinerary options for the group.
     """
-    from algorithms.optimizer import optimize_route, create_travel_plan
-    from generators.itinerary import generate_full_trip_itinerary, combine_group_preferences
-    import time
-
     # Step 1: Select region
     selected_region, region_cities = select_region(users_data, regions_data)
 
+    region_soa = get_region_soa(regions_data, selected_region)
+
+    # Group-level values shared by every option (similarities, budget, accommodation...)
+    group_ctx = build_group_context(users_data, region_soa)
+
     # Step 2: Rank cities
-    ranked_cities = rank_cities_for_group(users_data, region_cities)
+    # (best few cities in order + every city's score)
+    ranked_cities, city_scores = rank_cities_for_group(users_data, region_soa, group_ctx)
 
     # Step 3: Calculate compatibility
-    group_compatibility = calculate_group_compatibility(users_data)
+    group_compatibility = calculate_group_compatibility(users_data, group_ctx)
 
-    # Step 4: Trip duration (median)
-    durations = [user['preferences']['duration'] for user in users_data]
-    avg_duration = int(np.median(durations))
+    # Step 4: Trip duration (median; a handful of values, so no numpy needed)
+    avg_duration = int(_median(group_ctx.durations.tolist()))
 
     # Step 5: City count logic
     if avg_duration <= 4:
@@ -110,115 +151,72 @@ def generate_itinerary_options(users_data, regions_data):
         num_cities = 3
     else:
         num_cities = 4
-    num_cities = min(num_cities, len(ranked_cities))
-
-    # === OPTION 1: Optimal ===
-    option1_cities_raw = [city[0] for city in ranked_cities[:num_cities]]
-    option1_cities, option1_distance, _ = optimize_route(option1_cities_raw, region_cities)
-    option1_travel_plan = create_travel_plan(option1_cities, region_cities)
-    option1_allocation = allocate_days_to_cities(option1_cities, avg_duration, region_cities)
-    option1_cost = estimate_trip_cost(users_data, option1_cities, option1_allocation, region_cities)
-
-    # === OPTION 2: Budget ===
-    budget_cities_raw = select_budget_friendly_cities(ranked_cities, num_cities, region_cities)
-    budget_cities, option2_distance, _ = optimize_route(budget_cities_raw, region_cities)
-    option2_travel_plan = create_travel_plan(budget_cities, region_cities)
-    option2_allocation = allocate_days_to_cities(budget_cities, avg_duration, region_cities)
-    option2_cost = estimate_trip_cost(users_data, budget_cities, option2_allocation, region_cities)
-
-    # === OPTION 3: Adventurous ===
-    adventurous_cities_raw = select_adventurous_mix(ranked_cities, num_cities, region_cities)
-    adventurous_cities, option3_distance, _ = optimize_route(adventurous_cities_raw, region_cities)
-    option3_travel_plan = create_travel_plan(adventurous_cities, region_cities)
-    option3_allocation = allocate_days_to_cities(adventurous_cities, avg_duration, region_cities)
-    option3_cost = estimate_trip_cost(users_data, adventurous_cities, option3_allocation, region_cities)
-
-    # Individual satisfaction
-    individual_scores_1 = [
-        calculate_individual_satisfaction(user, option1_cities, region_cities)
-        for user in users_data
-    ]
-    individual_scores_2 = [
-        calculate_individual_satisfaction(user, budget_cities, region_cities)
-        for user in users_data
-    ]
-    individual_scores_3 = [
-        calculate_individual_satisfaction(user, adventurous_cities, region_cities)
-        for user in users_data
+    num_cities = min(num_cities, len(region_soa.names))
+
+    # Step 6: Pick cities for each option
+    option_specs = [
+        (1, "Optimal Match", "Best overall match for your group's preferences",
+         [city[0] for city in ranked_cities[:num_cities]]),
+        (2, "Budget-Friendly", "Great experience at a lower cost",
+         select_budget_friendly_cities(ranked_cities, city_scores, num_cities, region_soa)),
+        (3, "Adventurous Mix", "Popular spots plus unique off-beat experiences",
+         select_adventurous_mix(ranked_cities, num_cities, region_soa)),
     ]
 
-    # === RESULTS ===
-    results = {
-        "selected_region": selected_region,
-        "group_compatibility": group_compatibility,
-        "options": [
-            {
-                "option_id": 1,
-                "name": "Optimal Match",
-                "description": "Best overall match for your group's preferences",
-                "cities": option1_cities,
-                "day_allocation": option1_allocation,
-                "total_days": avg_duration,
-                "total_distance_km": option1_distance,
-                "travel_plan": option1_travel_plan,
-                "estimated_cost_per_person": option1_cost,
-                "group_score": round(np.mean([city[1] for city in ranked_cities[:num_cities]]), 1),
-                "individual_scores": individual_scores_1,
-                "votes": 0
-            },
-            {
-                "option_id": 2,
-                "name": "Budget-Friendly",
-                "description": "Great experience at a lower cost",
-                "cities": budget_cities,
-                "day_allocation": option2_allocation,
-                "total_days": avg_duration,
-                "total_distance_km": option2_distance,
-                "travel_plan": option2_travel_plan,
-                "estimated_cost_per_person": option2_cost,
-                "group_score": round(np.mean([score for city, score in ranked_cities if city in budget_cities]), 1),
-                "individual_scores": individual_scores_2,
-                "votes": 0
-            },
-            {
-                "option_id": 3,
-                "name": "Adventurous Mix",
-                "description": "Popular spots plus unique off-beat experiences",
-                "cities": adventurous_cities,
-                "day_allocation": option3_allocation,
-                "total_days": avg_duration,
-                "total_distance_km": option3_distance,
-                "travel_plan": option3_travel_plan,
-                "estimated_cost_per_person": option3_cost,
-                "group_score": round(np.mean([score for city, score in ranked_cities if city in adventurous_cities]), 1),
-                "individual_scores": individual_scores_3,
-                "votes": 0
-            }
+    # Step 7: Route, days, cost and scores for each option.
+    # Options don't depend on each other, so build them in parallel
+    # (the numpy work releases the GIL).
+    # One extra worker runs the Gemini call for Option 1 (to avoid quota issue,
+    # only Option 1 gets a detailed itinerary).
+    executor = ThreadPoolExecutor(max_workers=len(option_specs) + 1)
+    try:
+        futures = [
+            executor.submit(_build_option, spec, city_scores, avg_duration,
+                            users_data, region_soa, group_ctx)
+            for spec in option_specs
         ]
-    }
 
-    # === GENERATE DETAILED ITINERARY (Gemini) ===
-    group_prefs_combined = combine_group_preferences(users_data)
+        # === GENERATE DETAILED ITINERARY (Gemini) ===
+        # Start it as soon as Option 1 is ready so the network wait
+        # overlaps with building the other options
+        option1 = futures[0].result()
+        group_prefs_combined = combine_group_preferences(users_data, group_ctx.user_matrix)
 
-    for i in [0]:  # Only for first option (to avoid quota issue)
-        option = results['options'][i]
-        try:
-            print(f"Generating detailed itinerary for Option {i + 1}: {option['name']}...")
+        print(f"Generating detailed itinerary for Option 1: {option1['name']}...")
+        itinerary_future = executor.submit(
+            generate_full_trip_itinerary,
+            option_data=option1,
+            region_cities=region_cities,
+            group_preferences_combined=group_prefs_combined
+        )
+
+        options = [future.result() for future in futures]
 
-            detailed_itinerary = generate_full_trip_itinerary(
-                option_data=option,
-                region_cities=region_cities,
-                group_preferences_combined=group_prefs_combined
-            )
+        try:
+            option1['detailed_itinerary'] = itinerary_future.result(timeout=ITINERARY_TIMEOUT_SECONDS)
+            print("✓ Option 1 detailed itinerary generated successfully!")
 
-            results['options'][i]['detailed_itinerary'] = detailed_itinerary
-            print(f"✓ Option {i + 1} detailed itinerary generated successfully!")
+        except FutureTimeoutError:
+            print(f"✗ Itinerary for Option 1 timed out after {ITINERARY_TIMEOUT_SECONDS}s")
+            option1['detailed_itinerary'] = {
+                'error': f'Could not generate detailed itinerary: timed out after {ITINERARY_TIMEOUT_SECONDS}s'
+            }
 
         except Exception as e:
-            print(f"✗ Error generating itinerary for Option {i + 1}: {str(e)}")
-            results['options'][i]['detailed_itinerary'] = {
+            print(f"✗ Error generating itinerary for Option 1: {str(e)}")
+            option1['detailed_itinerary'] = {
                 'error': f'Could not generate detailed itinerary: {str(e)}'
             }
+    finally:
+        # Don't block on a timed-out Gemini call; let it finish in the background
+        executor.shutdown(wait=False)
+
+    # === RESULTS ===
+    results = {
+        "selected_region": selected_region,
+        "group_compatibility": group_compatibility,
+        "options": options
+    }
 
     # Add note for other options
     for i in [1, 2]:
@@ -229,22 +227,18 @@ def generate_itinerary_options(users_data, regions_data):
     return results
 
 
-def select_budget_friendly_cities(ranked_cities, num_cities, cities_database):
+def select_budget_friendly_cities(ranked_cities, city_scores, num_cities, region_soa):
     """
     Select cheaper but good-score cities.
-    """
-    city_costs = []
-    for city_name, score in ranked_cities:
-        city_data = cities_database.get(city_name, {})
-        avg_cost = city_data.get('avg_daily_cost', {}).get('mid-range', 5000)
-        typical_days = city_data.get('typical_days', 2)
-        total_cost = avg_cost * typical_days
 
-        if score > 60:
-            city_costs.append((city_name, score, total_cost))
+    Cities scoring above 60 are taken cheapest first (ties: higher score first);
+    if there aren't enough, fill up from the top of ranked_cities.
+    """
+    total_costs = region_soa.daily_cost['mid-range'] * region_soa.typical_days
 
-    city_costs.sort(key=lambda x: x[2])
-    selected = [city[0] for city in city_costs[:num_cities]]
+    good = np.flatnonzero(city_scores > 60)
+    good = good[np.lexsort((good, -city_scores[good], total_costs[good]))]
+    selected = [region_soa.names[j] for j in good[:num_cities]]
 
     if len(selected) < num_cities:
         for city, score in ranked_cities:
@@ -255,9 +249,12 @@ def select_budget_friendly_cities(ranked_cities, num_cities, cities_database):
     return selected
 
 
-def select_adventurous_mix(ranked_cities, num_cities, cities_database):
+def select_adventurous_mix(ranked_cities, num_cities, region_soa, rng=None):
     """
     Mix top + off-beat cities.
+
+    rng: random.Random to shuffle with (for reproducible picks); defaults to
+    the module-level random generator
     """
     selected = []
 
@@ -265,7 +262,7 @@ def select_adventurous_mix(ranked_cities, num_cities, cities_database):
         selected.append(ranked_cities[0][0])
 
     mid_ranked = ranked_cities[3:min(8, len(ranked_cities))]
-    np.random.shuffle(mid_ranked)
+    (rng or random).shuffle(mid_ranked)
 
     for city, score in mid_ranked:
         if len(selected) >= num_cities:
@@ -282,19 +279,21 @@ def select_adventurous_mix(ranked_cities, num_cities, cities_database):
     return selected
 
 
-def estimate_trip_cost(users_data, selected_cities, day_allocation, cities_database):
+def estimate_trip_cost(users_data, selected_cities, day_allocation, region_soa, accommodation=None):
     """
     Estimate total cost per person.
+
+    accommodation: Group's most common accommodation type, if already known
     """
-    accommodation_prefs = [user['preferences']['accommodation'] for user in users_data]
-    most_common = max(set(accommodation_prefs), key=accommodation_prefs.count)
+    if accommodation is None:
+        accommodation = most_common_accommodation(users_data)
 
-    total_cost = 0
+    daily_costs = region_soa.daily_cost.get(accommodation, region_soa.daily_cost['mid-range'])
+    idx = region_soa.indices(day_allocation.keys())
+    days = np.fromiter(day_allocation.values(), dtype=np.float64, count=len(day_allocation))
 
-    for city, days in day_allocation.items():
-        city_data = cities_database.get(city, {})
-        daily_cost = city_data.get('avg_daily_cost', {}).get(most_common, 3000)
-        total_cost += (daily_cost + 1500 + 500) * days
+    # Daily stay cost plus fixed daily extras (₹1500 + ₹500)
+    total_cost = float(((daily_costs[idx] + 1500 + 500) * days).sum())
 
     num_transitions = len(selected_cities) - 1
     total_cost += num_transitions * 2000
@@ -2,14 +2,17 @@
 Route optimization: Find the best order to visit cities.
 """
 
-import math
-from itertools import permutations
+import numpy as np
+
+# Held-Karp is O(N²·2^N): exact and instant up to here, heuristic beyond
+MAX_EXACT_ROUTE_CITIES = 15
 
 def calculate_distance(lat1, lon1, lat2, lon2):
     """
     Calculate distance between two coordinates using Haversine formula.
     
     Returns distance in kilometers.
+    Works on plain numbers or numpy arrays (element-wise, with broadcasting).
     
     Why Haversine?
     - Earth is a sphere, not flat
@@ -25,23 +28,48 @@ def calculate_distance(lat1, lon1, lat2, lon2):
     R = 6371
     
     # Convert degrees to radians
-    lat1_rad = math.radians(lat1)
-    lat2_rad = math.radians(lat2)
-    delta_lat = math.radians(lat2 - lat1)
-    delta_lon = math.radians(lon2 - lon1)
+    lat1_rad = np.radians(lat1)
+    lat2_rad = np.radians(lat2)
+    delta_lat = np.radians(np.subtract(lat2, lat1))
+    delta_lon = np.radians(np.subtract(lon2, lon1))
     
     # Haversine formula
-    a = (math.sin(delta_lat / 2) ** 2 +
-         math.cos(lat1_rad) * math.cos(lat2_rad) *
-         math.sin(delta_lon / 2) ** 2)
+    a = (np.sin(delta_lat / 2) ** 2 +
+         np.cos(lat1_rad) * np.cos(lat2_rad) *
+         np.sin(delta_lon / 2) ** 2)
     
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
     
     distance = R * c
     
     return distance
 
-def calculate_route_distance(cities_order, cities_database):
+def _haversine_matrix(lats, lons):
+    """
+    Distances between every pair of coordinates (N×N, symmetric, zero diagonal).
+    
+    One broadcast Haversine call instead of N² scalar ones.
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    
+    return calculate_distance(lats[:, None], lons[:, None], lats[None, :], lons[None, :])
+
+def _city_coordinates(cities_list, region_soa):
+    """Latitude and longitude arrays for the given cities, in order."""
+    idx = region_soa.indices(cities_list)
+    return region_soa.lat[idx], region_soa.lon[idx]
+
+def _route_segment_distances(cities_order, region_soa):
+    """
+    Distance of each leg of a route, all legs in one vectorized Haversine call.
+    
+    Returns: Array of length len(cities_order) - 1
+    """
+    lats, lons = _city_coordinates(cities_order, region_soa)
+    return calculate_distance(lats[:-1], lons[:-1], lats[1:], lons[1:])
+
+def calculate_route_distance(cities_order, region_soa):
     """
     Calculate total distance for a specific route.
     
@@ -50,82 +78,224 @@ def calculate_route_distance(cities_order, cities_database):
     
     Returns: Total distance in km
     """
-    total_distance = 0
+    return float(_route_segment_distances(cities_order, region_soa).sum())
+
+def _build_distance_matrix(cities_list, region_soa):
+    """
+    Distances between every pair of cities (N×N, symmetric, zero diagonal).
+    
+    Computed once so route search never re-evaluates Haversine for the same pair.
+    """
+    lats, lons = _city_coordinates(cities_list, region_soa)
+    return _haversine_matrix(lats, lons)
+
+def _opt_route_2(distances):
+    """
+    Best route for 2 cities: there is only one (up to reversal).
+    """
+    return [0, 1]
+
+def _opt_route_3(distances):
+    """
+    Best route for 3 cities: the path skips exactly one of the 3 legs,
+    so keep the two cities that are furthest apart as the endpoints.
+    
+    Returns: List of city indices in visiting order
+    """
+    d = distances.tolist()
+    d01, d02, d12 = d[0][1], d[0][2], d[1][2]
+    
+    # Length of each path = all three legs minus the skipped one
+    if d02 >= d01 and d02 >= d12:
+        return [0, 1, 2]      # skips 0-2
+    if d01 >= d12:
+        return [0, 2, 1]      # skips 0-1
+    return [1, 0, 2]          # skips 1-2
+
+def _opt_route_4(distances):
+    """
+    Best route for 4 cities: compare all 12 distinct paths directly.
+    
+    Returns: List of city indices in visiting order
+    """
+    d = distances.tolist()
+    d01, d02, d03 = d[0][1], d[0][2], d[0][3]
+    d12, d13, d23 = d[1][2], d[1][3], d[2][3]
+    
+    # Every path up to reversal (start < end), in permutation order
+    candidates = (
+        (d01 + d12 + d23, (0, 1, 2, 3)),
+        (d01 + d13 + d23, (0, 1, 3, 2)),
+        (d02 + d12 + d13, (0, 2, 1, 3)),
+        (d02 + d23 + d13, (0, 2, 3, 1)),
+        (d03 + d13 + d12, (0, 3, 1, 2)),
+        (d03 + d23 + d12, (0, 3, 2, 1)),
+        (d01 + d02 + d23, (1, 0, 2, 3)),
+        (d01 + d03 + d23, (1, 0, 3, 2)),
+        (d12 + d02 + d03, (1, 2, 0, 3)),
+        (d13 + d03 + d02, (1, 3, 0, 2)),
+        (d02 + d01 + d13, (2, 0, 1, 3)),
+        (d12 + d01 + d03, (2, 1, 0, 3)),
+    )
+    
+    best_length, best_route = candidates[0]
+    for length, route in candidates[1:]:
+        if length < best_length:
+            best_length, best_route = length, route
+    
+    return list(best_route)
+
+# Trips have 2-4 cities (by duration), so these sizes get a dedicated solver
+_SMALL_ROUTE_SOLVERS = {2: _opt_route_2, 3: _opt_route_3, 4: _opt_route_4}
+
+def _held_karp_path(distances):
+    """
+    Exact shortest path visiting every city once (open path, any start/end).
+    
+    Dynamic programming over subsets:
+    - best[mask][i] = shortest path covering cities in `mask`, ending at i
+    - best[mask][i] = min over j of best[mask without i][j] + distance[j][i]
+    
+    Returns: List of city indices in visiting order
+    """
+    n = len(distances)
+    num_masks = 1 << n
     
-    for i in range(len(cities_order) - 1):
-        city1 = cities_order[i]
-        city2 = cities_order[i + 1]
-        
-        # Get coordinates
-        loc1 = cities_database[city1]['location']
-        loc2 = cities_database[city2]['location']
-        
-        # Calculate distance between consecutive cities
-        dist = calculate_distance(loc1['lat'], loc1['lon'],
-                                  loc2['lat'], loc2['lon'])
-        
-        total_distance += dist
+    best = np.full((num_masks, n), np.inf)
+    parent = np.full((num_masks, n), -1, dtype=np.int64)
     
-    return total_distance
+    # A path can start at any city
+    for i in range(n):
+        best[1 << i, i] = 0.0
+    
+    for mask in range(1, num_masks):
+        for i in range(n):
+            prev_mask = mask ^ (1 << i)
+            if not mask & (1 << i) or prev_mask == 0:
+                continue
+            
+            # Cities not in prev_mask are still inf, so they never win
+            candidates = best[prev_mask] + distances[:, i]
+            j = int(np.argmin(candidates))
+            best[mask, i] = candidates[j]
+            parent[mask, i] = j
+    
+    # Walk the parent table back from the best end city
+    mask = num_masks - 1
+    city = int(np.argmin(best[mask]))
+    route = []
+    while city != -1:
+        route.append(city)
+        prev_city = int(parent[mask, city])
+        mask ^= 1 << city
+        city = prev_city
+    
+    return route[::-1]
+
+def _nearest_neighbor_2opt_path(distances):
+    """
+    Heuristic route for large N: greedy nearest neighbor, then 2-opt.
+    
+    2-opt keeps reversing a stretch of the route while that shortens it.
+    
+    Returns: List of city indices in visiting order
+    """
+    n = len(distances)
+    
+    route = [0]
+    unvisited = set(range(1, n))
+    while unvisited:
+        last = route[-1]
+        nearest = min(unvisited, key=lambda j: distances[last, j])
+        route.append(nearest)
+        unvisited.remove(nearest)
+    
+    improved = True
+    while improved:
+        improved = False
+        for i in range(n - 1):
+            for j in range(i + 1, n):
+                # Reversing route[i..j] only changes the two edges at its ends
+                before = after = 0.0
+                if i > 0:
+                    before += distances[route[i - 1], route[i]]
+                    after += distances[route[i - 1], route[j]]
+                if j < n - 1:
+                    before += distances[route[j], route[j + 1]]
+                    after += distances[route[i], route[j + 1]]
+                
+                if after < before - 1e-9:
+                    route[i:j + 1] = route[i:j + 1][::-1]
+                    improved = True
+    
+    return route
 
-def optimize_route(cities_list, cities_database):
+def optimize_route(cities_list, region_soa):
     """
     Find the best order to visit cities (minimize total travel distance).
     
-    Approach: Brute force for small N (≤7 cities)
-    - Try all possible orderings
-    - Calculate distance for each
-    - Pick shortest
+    Approach for 2-4 cities (every real trip): compare the handful of
+    possible routes directly (_opt_route_2/3/4)
+    
+    Approach for 5-15 cities: Held-Karp dynamic programming
+    - Precompute the distance between every pair of cities once
+    - Build up shortest paths over growing subsets of cities
+    - Guarantees the optimal order, like trying all permutations
     
-    Why brute force?
-    - N! permutations (3 cities = 6, 4 cities = 24, 5 cities = 120)
-    - For small N, brute force is fast and guarantees optimal solution
-    - Alternative: TSP algorithms (overkill for our use case)
+    Why not brute force?
+    - N! permutations explode (7 cities = 5040 routes × 6 distances each)
+    - Held-Karp needs N²·2^N steps (7 cities ≈ 6,000) and reuses the matrix
     
-    For larger N (>7), we'd use heuristics like nearest neighbor or genetic algorithm.
-    But our trips are 2-4 cities, so brute force is perfect.
+    For larger N (>15), we use nearest neighbor + 2-opt (fast, near-optimal).
     
-    Returns: (optimized_order, total_distance, distance_matrix)
+    Returns: (optimized_order, total_distance, segment_distances)
+    - segment_distances: Array with the km of each leg, in route order
+      (pass it to create_travel_plan so legs aren't measured twice)
     """
     if len(cities_list) <= 1:
-        return cities_list, 0, {}
+        return cities_list, 0, np.zeros(0)
     
-    # For 2 cities, no optimization needed (only one route)
-    if len(cities_list) == 2:
-        distance = calculate_route_distance(cities_list, cities_database)
-        distance_matrix = {
-            f"{cities_list[0]}-{cities_list[1]}": round(distance, 1)
-        }
-        return cities_list, round(distance, 1), distance_matrix
-    
-    # For 3+ cities, try all permutations
-    best_route = None
-    best_distance = float('inf')
-    
-    # Try all possible orderings
-    for route in permutations(cities_list):
-        route = list(route)
-        distance = calculate_route_distance(route, cities_database)
-        
-        if distance < best_distance:
-            best_distance = distance
-            best_route = route
-    
-    # Build distance matrix (shows distance between each pair of cities)
-    distance_matrix = {}
-    for i in range(len(best_route) - 1):
-        city1 = best_route[i]
-        city2 = best_route[i + 1]
-        
-        loc1 = cities_database[city1]['location']
-        loc2 = cities_database[city2]['location']
-        
-        dist = calculate_distance(loc1['lat'], loc1['lon'],
-                                  loc2['lat'], loc2['lon'])
-        
-        distance_matrix[f"{city1}-{city2}"] = round(dist, 1)
-    
-    return best_route, round(best_distance, 1), distance_matrix
+    distances = _build_distance_matrix(cities_list, region_soa)
+    
+    if len(cities_list) in _SMALL_ROUTE_SOLVERS:
+        route_idx = _SMALL_ROUTE_SOLVERS[len(cities_list)](distances)
+    elif len(cities_list) <= MAX_EXACT_ROUTE_CITIES:
+        route_idx = _held_karp_path(distances)
+    else:
+        route_idx = _nearest_neighbor_2opt_path(distances)
+    
+    # A route and its reverse are equally long: always return the one starting
+    # with the earlier input city. (Permutation search picked whichever summed
+    # smaller in floating point, so a few routes - and their day split - differ.)
+    if route_idx[0] > route_idx[-1]:
+        route_idx.reverse()
+    
+    best_route = [cities_list[i] for i in route_idx]
+    
+    # Leg distances straight from the matrix (no more Haversine)
+    segment_distances = distances[route_idx[:-1], route_idx[1:]]
+    
+    return best_route, round(float(segment_distances.sum()), 1), segment_distances
+
+# Travel time bands: up to 200 km by car, up to 500 km by train, then flight
+_TIME_BOUNDS_KM = np.array([200, 500])
+_SPEEDS_KMH = np.array([60.0, 80.0, np.inf])  # flight time is fixed, not speed-based
+FLIGHT_HOURS = 2.0
+
+# Transport bands: <100 km, <300 km, <500 km, 500+ km
+_TRANSPORT_BOUNDS_KM = np.array([100, 300, 500])
+_TRANSPORT_MODES = np.array(["Car/Taxi", "Car or Train", "Train", "Flight"])
+
+def _travel_time_hours(distances):
+    """Unrounded travel time for each distance (table lookup, no branching)."""
+    # side='left' counts bounds strictly below: >200 km → train, >500 km → flight
+    band = np.searchsorted(_TIME_BOUNDS_KM, distances, side='left')
+    return np.where(band == 2, FLIGHT_HOURS, distances / _SPEEDS_KMH[band])
+
+def _transport_band(distances):
+    """Index into _TRANSPORT_MODES for each distance."""
+    # side='right' counts bounds at or below: exactly 100 km is already "Car or Train"
+    return np.searchsorted(_TRANSPORT_BOUNDS_KM, distances, side='right')
 
 def estimate_travel_time(distance_km, transport_mode="car"):
     """
@@ -143,17 +313,7 @@ def estimate_travel_time(distance_km, transport_mode="car"):
     - Includes buffer for breaks, delays
     - India-specific (traffic, road conditions)
     """
-    if distance_km > 500:
-        # Long distance = flight recommended
-        return 2.0  # Assume fixed 2 hours door-to-door for flights
-    elif distance_km > 200:
-        # Medium distance = train preferred
-        avg_speed = 80  # km/h
-        return round(distance_km / avg_speed, 1)
-    else:
-        # Short distance = car/taxi
-        avg_speed = 60  # km/h
-        return round(distance_km / avg_speed, 1)
+    return round(float(_travel_time_hours(distance_km)), 1)
 
 def get_recommended_transport(distance_km):
     """
@@ -167,19 +327,31 @@ def get_recommended_transport(distance_km):
     
     Returns: Transport mode as string
     """
-    if distance_km < 100:
-        return "Car/Taxi"
-    elif distance_km < 300:
-        return "Car or Train"
-    elif distance_km < 500:
-        return "Train"
-    else:
-        return "Flight"
+    return str(_TRANSPORT_MODES[_transport_band(distance_km)])
+
+def _classify_segments(distances):
+    """
+    Transport, travel time and cost for every leg at once.
+    
+    Cost (rough estimates in ₹): flight ₹4000, any train option ₹1500,
+    car ₹10 per km.
+    
+    Returns: (transports, travel_times, costs) as lists
+    """
+    band = _transport_band(distances)
+    costs = np.where(band == 3, 4000,
+            np.where(band >= 1, 1500, (distances * 10).astype(np.int64)))
+    
+    return (_TRANSPORT_MODES[band].tolist(),
+            _travel_time_hours(distances).tolist(),
+            costs.tolist())
 
-def create_travel_plan(cities_order, cities_database):
+def create_travel_plan(cities_order, segment_distances):
     """
     Create detailed travel plan with timings and transport recommendations.
     
+    segment_distances: km of each leg, as returned by optimize_route
+    
     Returns: List of travel segments with details
     
     Example output:
@@ -195,37 +367,17 @@ def create_travel_plan(cities_order, cities_database):
         ...
     ]
     """
-    travel_plan = []
-    
-    for i in range(len(cities_order) - 1):
-        city1 = cities_order[i]
-        city2 = cities_order[i + 1]
-        
-        # Calculate distance
-        loc1 = cities_database[city1]['location']
-        loc2 = cities_database[city2]['location']
-        distance = calculate_distance(loc1['lat'], loc1['lon'],
-                                     loc2['lat'], loc2['lon'])
-        
-        # Estimate time and transport
-        travel_time = estimate_travel_time(distance)
-        transport = get_recommended_transport(distance)
-        
-        # Estimate cost (rough estimates in ₹)
-        if "Flight" in transport:
-            cost = 4000
-        elif "Train" in transport:
-            cost = 1500
-        else:
-            cost = int(distance * 10)  # ₹10 per km for car
-        
-        travel_plan.append({
-            "from": city1,
-            "to": city2,
-            "distance_km": round(distance, 1),
-            "travel_time_hours": travel_time,
-            "transport": transport,
-            "cost_estimate": cost
-        })
-    
-    return travel_plan
\ No newline at end of file
+    # Classify all legs at once
+    transports, travel_times, costs = _classify_segments(segment_distances)
+    
+    return [
+        {
+            "from": cities_order[i],
+            "to": cities_order[i + 1],
+            "distance_km": round(float(segment_distances[i]), 1),
+            "travel_time_hours": round(travel_times[i], 1),
+            "transport": transports[i],
+            "cost_estimate": costs[i]
+        }
+        for i in range(len(segment_distances))
+    ]
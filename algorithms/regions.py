@@ -0,0 +1,94 @@
+"""
+Array view of the regions database: one numpy array per city attribute.
+"""
+
+from dataclasses import dataclass
+import numpy as np
+from algorithms.scoring import ACTIVITY_KEYS
+
+
+@dataclass(eq=False)
+class RegionSoA:
+    """
+    All cities of one region as a "structure of arrays".
+
+    Row j of every array belongs to names[j]; name_to_idx maps back.
+
+    Why arrays instead of the nested city dicts?
+    - Scoring, routing and costing work on all cities at once (numpy)
+    - No repeated dict walking (cities[city]['avg_daily_cost'][tier]) per request
+
+    Compared and hashed by identity (eq=False), so it can be part of a cache key.
+    """
+    names: list
+    lat: np.ndarray
+    lon: np.ndarray
+    activities: np.ndarray      # (C, 7) in ACTIVITY_KEYS order
+    daily_cost: dict            # accommodation tier -> (C,) costs
+    typical_days: np.ndarray
+    name_to_idx: dict
+
+    def indices(self, city_names):
+        """Row indices for a list of city names (keeps their order)."""
+        return np.array([self.name_to_idx[city] for city in city_names], dtype=np.intp)
+
+
+def _build_soa(cities_dict):
+    """
+    Convert one region's city dict into a RegionSoA.
+
+    Missing values get the same defaults the algorithms always used:
+    2 typical days, and mid-range cost for a missing accommodation tier.
+    """
+    names = list(cities_dict.keys())
+    cities = [cities_dict[name] for name in names]
+
+    activities = np.array([
+        [city.get('activities', {}).get(key, 0) for key in ACTIVITY_KEYS]
+        for city in cities
+    ], dtype=np.float64).reshape(len(names), len(ACTIVITY_KEYS))
+
+    tiers = {tier for city in cities for tier in city.get('avg_daily_cost', {})}
+    daily_cost = {
+        tier: np.array([
+            city['avg_daily_cost'].get(tier, city['avg_daily_cost'].get('mid-range', 3000))
+            for city in cities
+        ], dtype=np.float64)
+        for tier in tiers
+    }
+
+    return RegionSoA(
+        names=names,
+        lat=np.array([city['location']['lat'] for city in cities], dtype=np.float64),
+        lon=np.array([city['location']['lon'] for city in cities], dtype=np.float64),
+        activities=activities,
+        daily_cost=daily_cost,
+        typical_days=np.array([city.get('typical_days', 2) for city in cities], dtype=np.float64),
+        name_to_idx={name: j for j, name in enumerate(names)}
+    )
+
+
+def build_region_soa(regions_data):
+    """
+    Build the array view for every region, once at startup.
+
+    Stored next to the raw data: regions_data['regions'][region]['_soa']
+
+    Returns: regions_data (same dict, updated in place)
+    """
+    for region in regions_data['regions'].values():
+        region['_soa'] = _build_soa(region['cities'])
+
+    return regions_data
+
+
+def get_region_soa(regions_data, region_name):
+    """
+    Get the array view for one region, building it if startup didn't.
+    """
+    region = regions_data['regions'][region_name]
+
+    if '_soa' not in region:
+        region['_soa'] = _build_soa(region['cities'])
+
+    return region['_soa']
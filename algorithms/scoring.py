@@ -2,8 +2,23 @@
 Scoring algorithms for matching users with cities and calculating compatibility.
 """
 
+from collections import Counter
+from dataclasses import dataclass
+from functools import lru_cache
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
+
+# Fixed order of activity dimensions used for every preference vector
+ACTIVITY_KEYS = ('adventure', 'culture', 'food', 'nightlife', 'beach', 'nature', 'shopping')
+
+# How many best cities rank_cities_for_group sorts (options never look further down)
+TOP_RANKED_CITIES = 8
+
+
+def _activity_vector(activities):
+    """Convert an activity dict into a float vector in ACTIVITY_KEYS order."""
+    return np.fromiter((activities.get(key, 0) for key in ACTIVITY_KEYS),
+                       dtype=np.float64, count=len(ACTIVITY_KEYS))
+
 
 def calculate_activity_similarity(user_activities, city_activities):
     """
@@ -19,102 +34,177 @@ def calculate_activity_similarity(user_activities, city_activities):
     - Handles different scales (user rates 1-5, city has 0-5)
     - Focuses on direction/pattern, not magnitude
     - Standard ML metric for preference matching
-    """
-    # Convert dicts to ordered lists (same order for both)
-    activity_keys = ['adventure', 'culture', 'food', 'nightlife', 'beach', 'nature', 'shopping']
     
-    user_vector = np.array([user_activities.get(key, 0) for key in activity_keys])
-    city_vector = np.array([city_activities.get(key, 0) for key in activity_keys])
+    Why plain numpy (not sklearn)?
+    - Two 7-element vectors: a dot product and two norms is all we need
+    - sklearn's input validation costs far more than the math itself
+    """
+    user_vector = _activity_vector(user_activities)
+    city_vector = _activity_vector(city_activities)
     
-    # Reshape for sklearn (expects 2D arrays)
-    user_vector = user_vector.reshape(1, -1)
-    city_vector = city_vector.reshape(1, -1)
+    dot = user_vector @ city_vector
+    user_norm = np.sqrt(user_vector @ user_vector)
+    city_norm = np.sqrt(city_vector @ city_vector)
     
-    # Calculate cosine similarity (returns 0-1)
-    similarity = cosine_similarity(user_vector, city_vector)[0][0]
+    # All-zero vector has no direction (sklearn also returned 0 here)
+    if user_norm == 0 or city_norm == 0:
+        return 0.0
     
     # Convert to 0-100 scale for easier interpretation
-    return similarity * 100
+    return 100.0 * dot / (user_norm * city_norm)
 
-def calculate_group_city_score(users_data, city_data):
+def most_common_accommodation(users_data):
     """
-    Calculate how well a city matches the ENTIRE group.
-    
-    Logic:
-    1. Calculate similarity for each user with this city
-    2. Average all similarities
-    3. Apply budget penalty if city too expensive
+    Accommodation type most of the group prefers.
     
-    Returns: Score 0-100
+    Ties go to the type that was submitted first.
+    """
+    accommodation_prefs = Counter(user['preferences']['accommodation'] for user in users_data)
+    return accommodation_prefs.most_common(1)[0][0]
+
+def group_budget_range(users_data):
+    """
+    Group's budget range: the overlap where everyone agrees.
     
-    Why average not sum?
-    - Fair for groups of any size
-    - One person's strong preference doesn't dominate
+    Returns: (group_min, group_max)
+    - group_min: Highest minimum (everyone can afford this)
+    - group_max: Lowest maximum (what tightest budget allows)
     """
-    similarities = []
+    group_min = max(user['preferences']['budget']['min'] for user in users_data)
+    group_max = min(user['preferences']['budget']['max'] for user in users_data)
+    return group_min, group_max
+
+def preferences_key(users_data):
+    """
+    Stable, hashable fingerprint of the preferences that drive scoring.
     
-    for user in users_data:
-        user_activities = user['preferences']['activities']
-        city_activities = city_data['activities']
-        
-        sim = calculate_activity_similarity(user_activities, city_activities)
-        similarities.append(sim)
+    One tuple per user: (sorted activity ratings, budget min, budget max,
+    accommodation, flexible dates). Used as the cache key for ranking and
+    compatibility, so repeat requests with the same preferences are free.
+    """
+    return tuple(
+        (
+            tuple(sorted(user['preferences']['activities'].items())),
+            user['preferences']['budget']['min'],
+            user['preferences']['budget']['max'],
+            user['preferences']['accommodation'],
+            user['preferences']['dates']['flexible']
+        )
+        for user in users_data
+    )
+
+def _normalize_rows(matrix):
+    """L2-normalize each row (all-zero rows stay zero). Returns a new array."""
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True).clip(min=1e-12)
+
+@dataclass(eq=False)
+class GroupContext:
+    """
+    Everything about the group that stays the same across itinerary options.
     
-    # Average similarity across all users
-    avg_similarity = np.mean(similarities)
+    Built once per request (build_group_context), then shared by ranking,
+    compatibility, costing and satisfaction scoring for every option.
     
-    # Budget penalty: If city is too expensive for group, reduce score
-    budget_penalty = calculate_budget_fit(users_data, city_data)
+    Two contexts are equal (and hash the same) when their preferences_key
+    matches, which is what lets ranking and compatibility be memoized.
+    """
+    user_matrix: np.ndarray         # (U, 7) activity ratings in ACTIVITY_KEYS order
+    user_unit: np.ndarray           # user_matrix with L2-normalized rows
+    durations: np.ndarray           # preferred trip length per user
+    accommodation: str              # most common accommodation type
+    budget_min: float               # group minimum (highest individual minimum)
+    budget_max: float               # group maximum (lowest individual maximum)
+    flexible: np.ndarray            # per user: are their dates flexible?
+    preferences_key: tuple          # see preferences_key()
+    city_similarities: np.ndarray = None  # (U, C) user × city similarity (0-100)
+    
+    def __eq__(self, other):
+        if not isinstance(other, GroupContext):
+            return NotImplemented
+        return self.preferences_key == other.preferences_key
+    
+    def __hash__(self):
+        return hash(self.preferences_key)
+
+def build_group_context(users_data, region_soa=None):
+    """
+    Compute the group-level values for one request.
     
-    # Final score = similarity × budget_fit (0-100 scale)
-    final_score = avg_similarity * budget_penalty
+    With a region, also fills city_similarities: one matrix multiply of
+    normalized activity vectors (cosine similarity for every user-city pair).
+    """
+    user_matrix = np.empty((len(users_data), len(ACTIVITY_KEYS)))
+    for i, user in enumerate(users_data):
+        user_matrix[i] = _activity_vector(user['preferences']['activities'])
+    
+    user_unit = _normalize_rows(user_matrix)
+    
+    budget_min, budget_max = group_budget_range(users_data)
+    
+    city_similarities = None
+    if region_soa is not None:
+        city_similarities = (user_unit @ _normalize_rows(region_soa.activities).T) * 100.0
+    
+    return GroupContext(
+        user_matrix=user_matrix,
+        user_unit=user_unit,
+        durations=np.array([user['preferences']['duration'] for user in users_data]),
+        accommodation=most_common_accommodation(users_data),
+        budget_min=budget_min,
+        budget_max=budget_max,
+        flexible=np.array([user['preferences']['dates']['flexible'] for user in users_data], dtype=bool),
+        preferences_key=preferences_key(users_data),
+        city_similarities=city_similarities
+    )
+
+def _budget_fit_multipliers(city_costs, group_min, group_max):
+    """
+    Budget fit multiplier for an array of city costs (see calculate_budget_fit).
     
-    return final_score
+    The whole penalty ladder is evaluated for every city at once; np.select
+    takes the first condition that holds, like an if/elif chain.
+    """
+    conditions = [
+        (city_costs >= group_min) & (city_costs <= group_max),  # Perfect fit
+        city_costs < group_min,                                  # Cheaper than expected (still good!)
+        city_costs <= group_max * 1.2,                           # Slightly expensive but doable
+        city_costs <= group_max * 1.5,                           # Expensive, but might be worth it
+    ]
+    choices = [1.0, 0.95, 0.8, 0.6]
+    
+    # Too expensive, heavy penalty
+    return np.select(conditions, choices, default=0.4)
 
-def calculate_budget_fit(users_data, city_data):
+def calculate_budget_fit(users_data, city_data, group_ctx=None):
     """
     Check if city fits within group's budget.
     
     Logic:
     1. Find group's budget overlap (min of max_budgets, max of min_budgets)
     2. Check if city's cost falls in this range
-    3. Return penalty multiplier: 1.0 (perfect fit) to 0.5 (expensive but possible)
+    3. Return penalty multiplier: 1.0 (perfect fit) to 0.4 (too expensive)
+    
+    group_ctx: GroupContext for this request, if already built
     
     Why not binary (yes/no)?
     - Some flexibility: slightly expensive city might still be worth it
     - Gradual penalty better than hard cutoff
     """
-    # Calculate group budget range (the overlap where everyone agrees)
-    min_budgets = [user['preferences']['budget']['min'] for user in users_data]
-    max_budgets = [user['preferences']['budget']['max'] for user in users_data]
-    
-    group_min = max(min_budgets)  # Highest minimum (everyone can afford this)
-    group_max = min(max_budgets)  # Lowest maximum (what tightest budget allows)
+    if group_ctx is None:
+        group_ctx = build_group_context(users_data)
     
     # Get city's daily cost for the accommodation type most people prefer
-    accommodation_prefs = [user['preferences']['accommodation'] for user in users_data]
-    most_common_accommodation = max(set(accommodation_prefs), key=accommodation_prefs.count)
-    
-    city_daily_cost = city_data['avg_daily_cost'].get(most_common_accommodation, 
+    city_daily_cost = city_data['avg_daily_cost'].get(group_ctx.accommodation, 
                                                        city_data['avg_daily_cost']['mid-range'])
     
     # Assume typical trip = 3 days for this city
     typical_days = city_data.get('typical_days', 2)
     city_total_cost = city_daily_cost * typical_days
     
-    # Calculate fit
-    if group_min <= city_total_cost <= group_max:
-        return 1.0  # Perfect fit
-    elif city_total_cost < group_min:
-        return 0.95  # Cheaper than expected (still good!)
-    elif city_total_cost <= group_max * 1.2:
-        return 0.8  # Slightly expensive but doable
-    elif city_total_cost <= group_max * 1.5:
-        return 0.6  # Expensive, but might be worth it
-    else:
-        return 0.4  # Too expensive, heavy penalty
+    return float(_budget_fit_multipliers(np.asarray(city_total_cost),
+                                         group_ctx.budget_min, group_ctx.budget_max))
 
-def calculate_group_compatibility(users_data):
+def calculate_group_compatibility(users_data, group_ctx=None):
     """
     Calculate how compatible the group is overall.
     
@@ -123,31 +213,38 @@ def calculate_group_compatibility(users_data):
     2. How much budget overlap?
     3. Date flexibility?
     
+    group_ctx: GroupContext for this request, if already built
+    
     Returns: Compatibility score 0-100
     
     Why this matters?
     - Shows user: "Your group agrees 85%" (builds confidence)
     - Helps algorithm: High compatibility = easier to find perfect trip
     """
-    # Activity compatibility: Compare all pairs of users
-    activity_similarities = []
+    if group_ctx is None:
+        group_ctx = build_group_context(users_data)
     
-    for i in range(len(users_data)):
-        for j in range(i + 1, len(users_data)):
-            user1_activities = users_data[i]['preferences']['activities']
-            user2_activities = users_data[j]['preferences']['activities']
-            
-            sim = calculate_activity_similarity(user1_activities, user2_activities)
-            activity_similarities.append(sim)
+    return _compatibility_cached(group_ctx)
+
+@lru_cache(maxsize=256)
+def _compatibility_cached(group_ctx):
+    """
+    calculate_group_compatibility body, memoized by the group's preferences_key.
+    """
+    num_users = len(group_ctx.flexible)
     
-    avg_activity_compatibility = np.mean(activity_similarities) if activity_similarities else 50
+    # Activity compatibility: Compare all pairs of users.
+    # Unit vectors times their transpose = cosine of every pair; keep each pair once
+    pair_similarities = (group_ctx.user_unit @ group_ctx.user_unit.T)[np.triu_indices(num_users, k=1)]
     
-    # Budget compatibility: How much overlap?
-    min_budgets = [user['preferences']['budget']['min'] for user in users_data]
-    max_budgets = [user['preferences']['budget']['max'] for user in users_data]
+    if pair_similarities.size:
+        avg_activity_compatibility = float(pair_similarities.mean()) * 100.0
+    else:
+        avg_activity_compatibility = 50
     
-    group_min = max(min_budgets)
-    group_max = min(max_budgets)
+    # Budget compatibility: How much overlap?
+    group_min = group_ctx.budget_min
+    group_max = group_ctx.budget_max
     
     if group_max >= group_min:
         # There's overlap - good!
@@ -158,9 +255,8 @@ def calculate_group_compatibility(users_data):
         budget_compatibility = max(0, 100 - gap_percent)
     
     # Date flexibility: More flexible = easier planning
-    flexible_count = sum(1 for user in users_data 
-                        if user['preferences']['dates']['flexible'])
-    date_flexibility = (flexible_count / len(users_data)) * 100
+    flexible_count = int(group_ctx.flexible.sum())
+    date_flexibility = (flexible_count / num_users) * 100
     
     # Weighted average (activities matter most, then budget, then dates)
     overall_compatibility = (
@@ -171,44 +267,83 @@ def calculate_group_compatibility(users_data):
     
     return round(overall_compatibility, 1)
 
-def calculate_individual_satisfaction(user_data, selected_cities, cities_database):
+def calculate_individual_satisfaction(group_ctx, selected_cities, region_soa):
     """
-    Calculate how satisfied ONE user will be with the selected cities.
+    Calculate how satisfied EACH user will be with the selected cities.
     
     Used to show: "This itinerary matches YOUR preferences 88%"
     
-    Returns: Satisfaction score 0-100
+    Reads the chosen cities' columns of the precomputed similarity matrix
+    and averages them per user (no per-user, per-city loops).
+    
+    Returns: List of satisfaction scores 0-100, one per user
     """
-    satisfactions = []
+    num_users = group_ctx.city_similarities.shape[0]
+    city_idx = [region_soa.name_to_idx[city] for city in selected_cities
+                if city in region_soa.name_to_idx]
     
-    for city_name in selected_cities:
-        city_data = cities_database.get(city_name, {})
-        if not city_data:
-            continue
-        
-        user_activities = user_data['preferences']['activities']
-        city_activities = city_data.get('activities', {})
-        
-        sim = calculate_activity_similarity(user_activities, city_activities)
-        satisfactions.append(sim)
+    if not city_idx:
+        return [50] * num_users
     
-    return round(np.mean(satisfactions), 1) if satisfactions else 50
+    satisfactions = group_ctx.city_similarities[:, city_idx].mean(axis=1)
+    
+    return [round(float(score), 1) for score in satisfactions]
 
-def rank_cities_for_group(users_data, cities_dict):
+def rank_cities_for_group(users_data, region_soa, group_ctx=None):
     """
-    Score and rank ALL cities for this group.
+    Score ALL cities for this group and rank the best ones.
+    
+    Logic:
+    1. Similarity of every user with every city (one matrix multiply)
+    2. Average over users to get each city's group similarity
+    3. Multiply by each city's budget fit
+    4. Pick the top TOP_RANKED_CITIES in O(C) (argpartition), sort only those
     
-    Returns: List of (city_name, score) sorted by score (best first)
+    group_ctx: GroupContext for this request, if already built
+    
+    Returns: (ranked_cities, city_scores)
+    - ranked_cities: List of (city_name, score) for the top cities, best first
+    - city_scores: Read-only array with every city's score, in region_soa.names order
     
     This is the core ranking function the consensus algorithm uses.
+    
+    Why average not sum?
+    - Fair for groups of any size
+    - One person's strong preference doesn't dominate
     """
-    city_scores = []
+    if group_ctx is None or group_ctx.city_similarities is None:
+        group_ctx = build_group_context(users_data, region_soa)
+    
+    ranked_cities, city_scores = _rank_cached(group_ctx, region_soa)
+    
+    # Copy so callers can't modify the cached ranking
+    return list(ranked_cities), city_scores
+
+@lru_cache(maxsize=256)
+def _rank_cached(group_ctx, region_soa):
+    """
+    rank_cities_for_group body, memoized by (preferences_key, region).
+    
+    Returns: (tuple of top (city_name, score), read-only array of all scores)
+    """
+    # Average each city's column of the (users × cities) similarity matrix
+    group_similarities = group_ctx.city_similarities.mean(axis=0)
+    
+    # Budget fit for every city, using the group's budget overlap
+    daily_costs = region_soa.daily_cost.get(group_ctx.accommodation, region_soa.daily_cost['mid-range'])
+    city_costs = daily_costs * region_soa.typical_days
+    
+    budget_fit = _budget_fit_multipliers(city_costs, group_ctx.budget_min, group_ctx.budget_max)
+    
+    # Final score = similarity × budget_fit (0-100 scale)
+    final_scores = group_similarities * budget_fit
+    final_scores.flags.writeable = False
     
-    for city_name, city_data in cities_dict.items():
-        score = calculate_group_city_score(users_data, city_data)
-        city_scores.append((city_name, score))
+    # Top k in O(C), then sort just those by score (ties keep database order)
+    k = min(TOP_RANKED_CITIES, len(final_scores))
+    top_idx = np.argpartition(-final_scores, k - 1)[:k] if k else np.arange(0)
+    top_idx = top_idx[np.lexsort((top_idx, -final_scores[top_idx]))]
     
-    # Sort by score descending (best cities first)
-    city_scores.sort(key=lambda x: x[1], reverse=True)
+    ranked_cities = tuple((region_soa.names[j], float(final_scores[j])) for j in top_idx)
     
-    return city_scores
\ No newline at end of file
+    return ranked_cities, final_scores
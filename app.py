@@ -1,14 +1,14 @@
 import streamlit as st
-import qrcode
+import segno
 from io import BytesIO
-from PIL import Image
 import urllib.parse
 
 # Import our utilities
 from utils.data_handler import (
     create_session, load_session, add_user_to_session,
-    get_session_progress, load_regions
+    get_session_progress, progress_from_session, load_regions, mark_session_complete
 )
+from algorithms.regions import build_region_soa
 
 # Page config - must be first Streamlit command
 st.set_page_config(
@@ -18,35 +18,47 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
+@st.cache_resource(show_spinner=False)
+def get_regions_data():
+    """
+    Load regions data and build the per-region numpy arrays, once per process.
+    
+    Why cache_resource (not cache_data)?
+    - cache_data hands every rerun a fresh unpickled copy, which costs about
+      as much as re-reading the JSON
+    - The algorithms cache results per RegionSoA object, so every rerun
+      must get the same object back
+    - The data is only read after this point
+    """
+    return build_region_soa(load_regions())
+
 # Load regions data (we'll need this throughout)
-REGIONS_DATA = load_regions()
+REGIONS_DATA = get_regions_data()
 AVAILABLE_REGIONS = list(REGIONS_DATA['regions'].keys())
 
+# Progress sections are fragments: they rerun on their own every
+# PROGRESS_POLL_SECONDS without rerunning the whole page
+PROGRESS_POLL_SECONDS = 5
+
+@st.cache_data(show_spinner=False)
 def generate_qr_code(url):
     """
     Generate QR code image for a URL.
-    Returns image in BytesIO format that Streamlit can display.
+    Returns PNG bytes that Streamlit can display.
     
-    Why BytesIO? Streamlit expects bytes, not PIL Image directly.
-    We convert PIL Image → bytes → Streamlit can display it.
+    Why segno? It writes the PNG straight from the QR matrix,
+    no PIL Image in between (qrcode + PIL did Image → PNG encode).
+    
+    Cached per URL: a session's link never changes, so the QR code is
+    only drawn once instead of on every rerun.
     """
-    qr = qrcode.QRCode(
-        version=1,
-        box_size=10,
-        border=4
-    )
-    qr.add_data(url)
-    qr.make(fit=True)
-    
-    # Create PIL Image
-    img = qr.make_image(fill_color="black", back_color="white")
-    
-    # Convert to bytes
+    qr = segno.make_qr(url, error='m')
+    
+    # Write PNG bytes (10px modules, 4-module quiet zone)
     buf = BytesIO()
-    img.save(buf, format='PNG')
-    buf.seek(0)
+    qr.save(buf, kind='png', scale=10, border=4)
     
-    return buf
+    return buf.getvalue()
 
 def show_homepage():
     """
@@ -141,22 +153,17 @@ def show_session_created():
         st.caption("Friends can enter this code manually")
     
     # WhatsApp share button
-    whatsapp_text = f"Join my trip planning! 🌍 {session_url}"
-    whatsapp_url = f"https://wa.me/?text={urllib.parse.quote(whatsapp_text)}"
-    st.link_button("Share on WhatsApp", whatsapp_url, type="primary")
+    # (URL-encoded once per session, not again on every rerun)
+    if st.session_state.get('_wa_sid') != session_id:
+        whatsapp_text = f"Join my trip planning! 🌍 {session_url}"
+        st.session_state['_wa_url'] = f"https://wa.me/?text={urllib.parse.quote(whatsapp_text)}"
+        st.session_state['_wa_sid'] = session_id
+    st.link_button("Share on WhatsApp", st.session_state['_wa_url'], type="primary")
     
     st.markdown("---")
     
-    # Show progress
-    submitted, expected, names = get_session_progress(session_id)
-    
-    st.subheader("👥 Who's Joined?")
-    progress_percent = submitted / expected if expected > 0 else 0
-    st.progress(progress_percent)
-    st.write(f"**{submitted} of {expected} people** have submitted preferences")
-    
-    if names:
-        st.write("✅ " + ", ".join(names))
+    # Show progress (keeps itself up to date)
+    show_creator_progress(session_id)
     
     # Button to go to form (creator also needs to fill preferences)
     if st.button("Fill My Preferences", type="primary", use_container_width=True):
@@ -165,10 +172,21 @@ def show_session_created():
         del st.session_state['creator_name']
         st.query_params.session = session_id
         st.rerun()
+
+@st.fragment(run_every=PROGRESS_POLL_SECONDS)
+def show_creator_progress(session_id):
+    """
+    Who has joined so far (creator's page).
+    """
+    submitted, expected, names = get_session_progress(session_id)
     
-    # Refresh button to check progress
-    if st.button("🔄 Refresh Progress"):
-        st.rerun()
+    st.subheader("👥 Who's Joined?")
+    progress_percent = submitted / expected if expected > 0 else 0
+    st.progress(progress_percent)
+    st.write(f"**{submitted} of {expected} people** have submitted preferences")
+    
+    if names:
+        st.write("✅ " + ", ".join(names))
 
 def show_join_session(session_id):
     """
@@ -190,6 +208,9 @@ def show_join_session(session_id):
         show_results(session)
         return
     
+    # Progress, from the session we just loaded (no extra reads)
+    submitted_count, expected, names = progress_from_session(session)
+    
     # Show header
     st.title(f"Join {session['creator']}'s Trip! ✈️")
     st.write(f"Fill in your preferences below. {session['expected_users']} travelers expected.")
@@ -334,16 +355,56 @@ def show_join_session(session_id):
                     st.success(f"✅ Thanks {user_name}! Your preferences are saved.")
                     st.balloons()
                     
-                    # Show progress
-                    submitted_count, expected, names = get_session_progress(session_id)
+                    # Show progress (including this submission)
+                    session = load_session(session_id)
+                    submitted_count, expected, names = progress_from_session(session)
                     st.info(f"👥 {submitted_count} of {expected} people have submitted.")
                 else:
                     st.error("Error saving preferences. Please try again.")
     
     # Show current progress OUTSIDE the form
     st.markdown("---")
-    submitted_count, expected, names = get_session_progress(session_id)
     
+    if submitted_count < expected:
+        # Still waiting: this part keeps itself up to date
+        # (starting from the session this run already loaded)
+        st.session_state['_join_session'] = session
+        show_join_progress(session_id)
+        return
+    
+    show_progress_bar(submitted_count, expected, names)
+    
+    # Generate button OUTSIDE form - everyone has submitted by now
+    # (kept out of the polling fragment so a timer rerun can't interrupt it)
+    st.success("🎉 Everyone has submitted! Ready to generate itinerary.")
+    if st.button("🚀 Generate Trip Plan", type="primary", use_container_width=True):
+        from algorithms.consensus import generate_itinerary_options
+        
+        with st.spinner("🧠 Analyzing preferences and finding perfect trip..."):
+            try:
+                # Run the consensus algorithm
+                results = generate_itinerary_options(session['users'], REGIONS_DATA)
+                
+                # Save results to session (mark as completed)
+                mark_session_complete(session_id, results)
+                
+                st.success("✅ Trip plan generated!")
+                st.balloons()
+                
+                session = load_session(session_id)
+
+                st.rerun() 
+                
+                # TODO: Replace st.json with beautiful results display (next step)
+                
+            except Exception as e:
+                st.error(f"Error generating trip plan: {str(e)}")
+                st.exception(e)  # Shows full error for debugging
+
+def show_progress_bar(submitted_count, expected, names):
+    """
+    Submission progress on the join page.
+    """
     st.subheader("👥 Current Progress")
     progress_percent = submitted_count / expected if expected > 0 else 0
     st.progress(progress_percent)
@@ -351,34 +412,25 @@ def show_join_session(session_id):
     
     if names:
         st.write("✅ Submitted: " + ", ".join(names))
-    
-    # Generate button OUTSIDE form - only show if everyone submitted
-    if submitted_count >= expected:
-        st.success("🎉 Everyone has submitted! Ready to generate itinerary.")
-        if st.button("🚀 Generate Trip Plan", type="primary", use_container_width=True):
-            from algorithms.consensus import generate_itinerary_options
-            
-            with st.spinner("🧠 Analyzing preferences and finding perfect trip..."):
-                try:
-                    # Run the consensus algorithm
-                    results = generate_itinerary_options(session['users'], REGIONS_DATA)
-                    
-                    # Save results to session (mark as completed)
-                    from utils.data_handler import mark_session_complete
-                    mark_session_complete(session_id, results)
-                    
-                    st.success("✅ Trip plan generated!")
-                    st.balloons()
-                    
-                    session = load_session(session_id)
 
-                    st.rerun() 
-                    
-                    # TODO: Replace st.json with beautiful results display (next step)
-                    
-                except Exception as e:
-                    st.error(f"Error generating trip plan: {str(e)}")
-                    st.exception(e)  # Shows full error for debugging
+@st.fragment(run_every=PROGRESS_POLL_SECONDS)
+def show_join_progress(session_id):
+    """
+    Join page progress while waiting for others to submit.
+    
+    A full page run hands over the session it loaded (no second read);
+    the fragment's own timer reruns load it again to see new submissions.
+    
+    Once everyone has submitted (or the plan was generated), reruns the
+    whole page so the Generate button / results appear.
+    """
+    session = st.session_state.pop('_join_session', None) or load_session(session_id)
+    submitted_count, expected, names = progress_from_session(session)
+    
+    if session['status'] == 'completed' or submitted_count >= expected:
+        st.rerun()
+    
+    show_progress_bar(submitted_count, expected, names)
 
 def show_results(session):
     """
@@ -390,6 +442,16 @@ def show_results(session):
         st.error("No results found. Please generate trip plan first.")
         return
     
+    # Display strings, built once per run (kept apart from the session:
+    # load_session's dict is shared and may still be waiting to be saved)
+    labels = {
+        option['option_id']: {
+            'route': " → ".join(option['cities']),
+            'cost': f"₹{option['estimated_cost_per_person']:,}"
+        }
+        for option in results['options']
+    }
+    
     # Header
     st.title(f"🎯 Your Group's Perfect Trip to {results['selected_region']}")
     
@@ -427,11 +489,14 @@ def show_results(session):
     # Display each option in its tab
     for tab, option in zip([tab1, tab2, tab3], results['options']):
         with tab:
-            display_option_details(option, session['users'], results['selected_region'])
+            display_option_details(option, session['users'], results['selected_region'],
+                                   labels[option['option_id']])
 
-def display_option_details(option, users, region):
+def display_option_details(option, users, region, labels):
     """
     Display detailed view of one itinerary option.
+    
+    labels: The option's preformatted 'route' and 'cost' strings
     """
     # Summary cards
     col1, col2, col3, col4 = st.columns(4)
@@ -443,7 +508,7 @@ def display_option_details(option, users, region):
         st.metric("Total Days", option['total_days'])
     
     with col3:
-        st.metric("Cost/Person", f"₹{option['estimated_cost_per_person']:,}")
+        st.metric("Cost/Person", labels['cost'])
     
     with col4:
         st.metric("Group Score", f"{option['group_score']}%")
@@ -452,8 +517,7 @@ def display_option_details(option, users, region):
     
     # Cities route
     st.subheader("📍 Your Route")
-    cities_route = " → ".join(option['cities'])
-    st.info(f"**{cities_route}**")
+    st.info(f"**{labels['route']}**")
     
     # Travel overview
     st.write(f"**Total Distance:** {option['total_distance_km']} km")
@@ -3,68 +3,85 @@ Gemini-powered itinerary generation.
 Generates detailed day-by-day plans for each city.
 """
 
+import asyncio
+import hashlib
+import heapq
+import json
+import threading
 import google.generativeai as genai
+import numpy as np
 import os
+import string
 from dotenv import load_dotenv
+from algorithms.scoring import ACTIVITY_KEYS
 
 load_dotenv()
 
-# Configure Gemini API
 # You'll set this as environment variable or directly here
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-genai.configure(api_key=GEMINI_API_KEY)
 
-# Initialize model
-model = genai.GenerativeModel("models/gemini-2.5-flash")
+# Gemini replies saved by prompt hash, so identical requests (e.g. clicking
+# Generate again) skip the API call, even after a restart
+REPLY_CACHE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'llm_cache'
+)
+os.makedirs(REPLY_CACHE_DIR, exist_ok=True)
 
-def generate_city_itinerary(city_name, num_days, group_preferences, budget_level, city_description):
+# One model handle per process, shared by every session and thread
+_model = None
+_model_lock = threading.Lock()
+
+def get_model():
     """
-    Generate detailed day-by-day itinerary for ONE city using Gemini.
-    
-    Args:
-        city_name: Name of the city
-        num_days: How many days to spend here
-        group_preferences: Dict with activity scores
-        budget_level: 'budget', 'mid-range', or 'luxury'
-        city_description: Brief description of the city
+    Configure Gemini and create the model handle, once per process.
     
-    Returns:
-        String with formatted itinerary
+    Why share it?
+    - The handle holds the API client (and its connections), not data
+    - Every user session reuses it instead of configuring its own
     
-    Why we need this?
-    - Our algorithm picks cities, but users need DETAILS
-    - What to do each day? Where to eat? What time?
-    - Gemini generates this rich content
+    Why not st.cache_resource?
+    - Itineraries are generated on worker threads, and Streamlit's caches
+      are skipped (recomputed every call) on threads without a script context
     """
-    
-    # Find top 3 activities the group loves
-    top_activities = sorted(group_preferences.items(), 
-                           key=lambda x: x[1], 
-                           reverse=True)[:3]
-    top_activity_names = [act[0] for act in top_activities]
-    
-    # Create detailed prompt for Gemini
-    prompt = f"""
-You are an expert travel planner. Create a detailed {num_days}-day itinerary for {city_name}.
+    global _model
+    with _model_lock:
+        if _model is None:
+            genai.configure(api_key=GEMINI_API_KEY)
+            _model = genai.GenerativeModel("models/gemini-2.5-flash")
+    return _model
 
-CITY INFO:
-{city_description}
+def _prompt_hash(prompt):
+    """
+    Short, stable cache key for a prompt (blake2b of its text).
+    
+    The prompt already contains everything the reply depends on
+    (city, days, group preferences, budget level, description).
+    """
+    return hashlib.blake2b(prompt.encode('utf-8'), digest_size=16).hexdigest()
 
-GROUP PREFERENCES:
-- Top interests: {', '.join(top_activity_names)}
-- Budget level: {budget_level}
-- Travel pace: moderate (not too rushed, but productive)
+def _read_cached_reply(prompt_hash):
+    """
+    Reply stored for this prompt hash, or None.
+    """
+    try:
+        with open(os.path.join(REPLY_CACHE_DIR, f'{prompt_hash}.txt'), 'r', encoding='utf-8') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
 
-REQUIREMENTS:
-1. Create a day-by-day plan for {num_days} days
-2. Focus heavily on {top_activity_names[0]} and {top_activity_names[1]} activities
-3. Include specific attractions, restaurants, and timings
-4. Add estimated costs in Indian Rupees (₹)
-5. Include practical tips (best time to visit, dress code, etc.)
-6. Suggest both popular AND hidden gems
-7. Keep budget appropriate for {budget_level} travelers
+def _store_reply(prompt_hash, reply):
+    """
+    Save a reply under its prompt hash (write to a temp file, then rename,
+    so a concurrent reader never sees half a file).
+    """
+    path = os.path.join(REPLY_CACHE_DIR, f'{prompt_hash}.txt')
+    tmp_path = f'{path}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(reply)
+    os.replace(tmp_path, path)
 
-FORMAT EACH DAY LIKE THIS:
+# Layout we ask Gemini to follow for every day of every city
+DAY_FORMAT = """FORMAT EACH DAY LIKE THIS:
 
 ## Day X: [Theme]
 
@@ -92,16 +109,121 @@ FORMAT EACH DAY LIKE THIS:
 [Restaurant suggestion]
 
 ---
+"""
+
+# Prompt templates: the fixed text is joined once here and only the ${fields}
+# are filled in per request (values may safely contain $ themselves)
+CITY_PROMPT = string.Template("""
+You are an expert travel planner. Create a detailed ${num_days}-day itinerary for ${city_name}.
 
+CITY INFO:
+${city_description}
+
+GROUP PREFERENCES:
+- Top interests: ${top_interests}
+- Budget level: ${budget_level}
+- Travel pace: moderate (not too rushed, but productive)
+
+REQUIREMENTS:
+1. Create a day-by-day plan for ${num_days} days
+2. Focus heavily on ${first_interest} and ${second_interest} activities
+3. Include specific attractions, restaurants, and timings
+4. Add estimated costs in Indian Rupees (₹)
+5. Include practical tips (best time to visit, dress code, etc.)
+6. Suggest both popular AND hidden gems
+7. Keep budget appropriate for ${budget_level} travelers
+
+""" + DAY_FORMAT + """
 START THE ITINERARY:
-"""
+""")
+
+TRIP_PROMPT = string.Template("""
+You are an expert travel planner. Create a detailed itinerary for each city of this trip.
+
+CITIES (in visiting order):
+${city_sections}
+
+GROUP PREFERENCES:
+- Top interests: ${top_interests}
+- Budget level: ${budget_level}
+- Travel pace: moderate (not too rushed, but productive)
+
+REQUIREMENTS:
+1. Create a day-by-day plan for each city, with exactly the number of days given
+2. Focus heavily on ${first_interest} and ${second_interest} activities
+3. Include specific attractions, restaurants, and timings
+4. Add estimated costs in Indian Rupees (₹)
+5. Include practical tips (best time to visit, dress code, etc.)
+6. Suggest both popular AND hidden gems
+7. Keep budget appropriate for ${budget_level} travelers
+8. Don't repeat the same kind of plan in every city
+
+""" + DAY_FORMAT + """
+OUTPUT:
+Reply with ONLY a JSON object (no other text). Its keys are exactly these city names:
+${city_names_json}
+Each value is that city's full itinerary as one markdown string, in the format above.
+""")
+
+def _top_activity_names(group_preferences, count=3):
+    """
+    Names of the group's highest-rated activities, best first.
+    """
+    # Same result (and tie order) as sorted(..., reverse=True)[:count],
+    # without sorting everything
+    top_activities = heapq.nlargest(count, group_preferences.items(),
+                                    key=lambda x: x[1])
+    return [act[0] for act in top_activities]
+
+def generate_city_itinerary(city_name, num_days, group_preferences, budget_level, city_description):
+    """
+    Generate detailed day-by-day itinerary for ONE city using Gemini.
+    
+    Args:
+        city_name: Name of the city
+        num_days: How many days to spend here
+        group_preferences: Dict with activity scores
+        budget_level: 'budget', 'mid-range', or 'luxury'
+        city_description: Brief description of the city
+    
+    Returns:
+        String with formatted itinerary
+    
+    Replies are cached on disk by prompt, so an identical request
+    (same city, days, preferences and budget) doesn't call Gemini again.
+    
+    Why we need this?
+    - Our algorithm picks cities, but users need DETAILS
+    - What to do each day? Where to eat? What time?
+    - Gemini generates this rich content
+    """
+    
+    # Find top 3 activities the group loves
+    top_activity_names = _top_activity_names(group_preferences)
+    
+    # Fill in the prompt template (the fixed text is built once, at import)
+    prompt = CITY_PROMPT.substitute(
+        num_days=num_days,
+        city_name=city_name,
+        city_description=city_description,
+        top_interests=', '.join(top_activity_names),
+        first_interest=top_activity_names[0],
+        second_interest=top_activity_names[1],
+        budget_level=budget_level
+    )
     
     try:
-        # Call Gemini API
-        response = model.generate_content(prompt)
+        # Reuse the reply from an identical earlier request, if any
+        prompt_hash = _prompt_hash(prompt)
+        itinerary_text = _read_cached_reply(prompt_hash)
         
-        # Extract text
-        itinerary_text = response.text
+        if itinerary_text is None:
+            # Call Gemini API
+            response = get_model().generate_content(prompt)
+            
+            # Extract text
+            itinerary_text = response.text
+            _store_reply(prompt_hash, itinerary_text)
         
         return itinerary_text
         
@@ -123,6 +245,102 @@ START THE ITINERARY:
 (Note: Detailed itinerary generation failed. Error: {str(e)})
 """
 
+def _parse_json_object(text):
+    """
+    Parse a JSON object out of a model reply (tolerates ```json fences).
+    
+    Returns: dict, or None if the reply isn't a JSON object
+    """
+    text = text.strip()
+    if text.startswith('```'):
+        text = text.split('\n', 1)[1] if '\n' in text else ''
+        text = text.rsplit('```', 1)[0]
+    
+    try:
+        parsed = json.loads(text)
+    except json.JSONDecodeError:
+        return None
+    
+    return parsed if isinstance(parsed, dict) else None
+
+def generate_trip_itineraries(city_requests, group_preferences, budget_level):
+    """
+    Generate the itineraries for ALL cities of a trip with ONE Gemini call.
+    
+    Args:
+        city_requests: List of dicts with city_name, num_days, city_description
+        group_preferences: Dict with activity scores
+        budget_level: 'budget', 'mid-range', or 'luxury'
+    
+    Returns:
+        Dict {city_name: itinerary string} for every city Gemini answered
+        (empty if the call or the JSON parsing failed)
+    
+    Why one call?
+    - One network round-trip instead of one per city
+    - The shared instructions are sent (and read by the model) once
+    - Gemini sees the whole trip, so cities don't repeat the same plans
+    """
+    top_activity_names = _top_activity_names(group_preferences)
+    
+    city_sections = "\n".join(
+        f"{i}. {request['city_name']} ({request['num_days']} days): {request['city_description']}"
+        for i, request in enumerate(city_requests, start=1)
+    )
+    city_names = [request['city_name'] for request in city_requests]
+    
+    prompt = TRIP_PROMPT.substitute(
+        city_sections=city_sections,
+        top_interests=', '.join(top_activity_names),
+        first_interest=top_activity_names[0],
+        second_interest=top_activity_names[1],
+        budget_level=budget_level,
+        city_names_json=json.dumps(city_names, ensure_ascii=False)
+    )
+    
+    prompt_hash = _prompt_hash(prompt)
+    
+    try:
+        # Same trip requested before (e.g. Generate clicked again): no API call
+        reply = _read_cached_reply(prompt_hash)
+        from_cache = reply is not None
+        if not from_cache:
+            reply = get_model().generate_content(prompt).text
+        parsed = _parse_json_object(reply)
+    except Exception as e:
+        print(f"✗ Batched itinerary request failed: {str(e)}")
+        return {}
+    
+    if parsed is None:
+        print("✗ Batched itinerary reply was not a JSON object")
+        return {}
+    
+    # Only keep replies we could use
+    if not from_cache:
+        _store_reply(prompt_hash, reply)
+    
+    return {
+        city: itinerary
+        for city, itinerary in parsed.items()
+        if city in city_names and isinstance(itinerary, str)
+    }
+
+async def _generate_city_itineraries(city_requests):
+    """
+    Run generate_city_itinerary for every city at the same time.
+    
+    city_requests: List of keyword-argument dicts, one per city
+    
+    Returns: List of itinerary strings, in the same order
+    
+    Each Gemini call is a blocking network round-trip, so they run on
+    worker threads and overlap instead of waiting one after another.
+    """
+    return await asyncio.gather(*(
+        asyncio.to_thread(generate_city_itinerary, **request)
+        for request in city_requests
+    ))
+
 def generate_full_trip_itinerary(option_data, region_cities, group_preferences_combined):
     """
     Generate complete itinerary for all cities in one option.
@@ -139,6 +357,9 @@ def generate_full_trip_itinerary(option_data, region_cities, group_preferences_c
     - Handles multiple cities
     - Coordinates between cities
     - Adds travel days
+    
+    All cities are requested in a single Gemini call; only cities missing
+    from its reply fall back to (concurrent) per-city calls.
     """
     
     cities = option_data['cities']
@@ -146,22 +367,41 @@ def generate_full_trip_itinerary(option_data, region_cities, group_preferences_c
     travel_plan = option_data.get('travel_plan', [])
     budget_level = 'mid-range'  # Default, could be calculated from user data
     
-    full_itinerary = {}
-    current_day = 1
-    
-    for i, city in enumerate(cities):
+    city_requests = []
+    for city in cities:
         city_data = region_cities.get(city, {})
         num_days = int(day_allocation.get(city, 2))  # Convert to int to fix error
         city_description = city_data.get('description', f'{city} - A wonderful destination')
         
-        # Generate itinerary for this city
-        city_itinerary = generate_city_itinerary(
-            city_name=city,
-            num_days=num_days,
-            group_preferences=group_preferences_combined,
-            budget_level=budget_level,
-            city_description=city_description
-        )
+        city_requests.append({
+            'city_name': city,
+            'num_days': num_days,
+            'group_preferences': group_preferences_combined,
+            'budget_level': budget_level,
+            'city_description': city_description
+        })
+    
+    # Generate itineraries for all cities with one Gemini call
+    trip_itineraries = generate_trip_itineraries(
+        city_requests, group_preferences_combined, budget_level
+    )
+    
+    # Any city missing from the reply gets its own call (concurrently)
+    missing_requests = [
+        request for request in city_requests
+        if request['city_name'] not in trip_itineraries
+    ]
+    if missing_requests:
+        missing_itineraries = asyncio.run(_generate_city_itineraries(missing_requests))
+        for request, city_itinerary in zip(missing_requests, missing_itineraries):
+            trip_itineraries[request['city_name']] = city_itinerary
+    
+    full_itinerary = {}
+    current_day = 1
+    
+    for i, city in enumerate(cities):
+        num_days = city_requests[i]['num_days']
+        city_itinerary = trip_itineraries[city]
         
         # Use integers for day ranges
         full_itinerary[city] = {
@@ -200,7 +440,7 @@ def generate_full_trip_itinerary(option_data, region_cities, group_preferences_c
     
     return full_itinerary
 
-def combine_group_preferences(users_data):
+def combine_group_preferences(users_data, user_matrix=None):
     """
     Average activity preferences across all users.
     
@@ -208,24 +448,24 @@ def combine_group_preferences(users_data):
     - Gemini needs ONE set of preferences to work with
     - Take the group's average interest in each activity
     
+    user_matrix: (users × activities) ratings in ACTIVITY_KEYS order,
+    if already built (GroupContext.user_matrix)
+    
     Returns: Dict like {'adventure': 3.5, 'culture': 4.2, ...}
     """
-    activity_sums = {
-        'adventure': 0, 'culture': 0, 'food': 0,
-        'nightlife': 0, 'beach': 0, 'nature': 0, 'shopping': 0
-    }
-    
-    num_users = len(users_data)
+    if user_matrix is None:
+        user_matrix = np.fromiter(
+            (user['preferences']['activities'].get(activity, 0)
+             for user in users_data for activity in ACTIVITY_KEYS),
+            dtype=np.float64, count=len(users_data) * len(ACTIVITY_KEYS)
+        ).reshape(-1, len(ACTIVITY_KEYS))
     
-    for user in users_data:
-        activities = user['preferences']['activities']
-        for activity, score in activities.items():
-            activity_sums[activity] += score
+    # Column means = each activity's group average
+    averages = user_matrix.mean(axis=0).tolist()
     
-    # Calculate averages
     avg_preferences = {
-        activity: round(total / num_users, 1)
-        for activity, total in activity_sums.items()
+        activity: round(average, 1)
+        for activity, average in zip(ACTIVITY_KEYS, averages)
     }
     
-    return avg_preferences
\ No newline at end of file
+    return avg_preferences
@@ -1,14 +1,187 @@
-import json
-import os 
+import atexit
+import copy
+import glob
+import orjson
+import os
+import queue
+import sqlite3
+import threading
 from datetime import datetime
-import uuid
+import secrets
 
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DATA_DIR = os.path.join(BASE_DIR,'data')
-SESSIONS_DIR = os.path.join(DATA_DIR,'sessions')
+SESSIONS_DB_PATH = os.path.join(DATA_DIR, 'sessions.db')
+# Where sessions lived before the database (one session_<id>.json each)
+LEGACY_SESSIONS_DIR = os.path.join(DATA_DIR, 'sessions')
 
-os.makedirs(SESSIONS_DIR, exist_ok=True)
+os.makedirs(DATA_DIR, exist_ok=True)
+
+# One table row per session, one row per (session, user).
+# name_key is the lowercased name: resubmitting under the same name
+# updates that user's row (and keeps their place in the list).
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id     TEXT PRIMARY KEY,
+    creator        TEXT NOT NULL,
+    expected_users INTEGER NOT NULL,
+    status         TEXT NOT NULL,
+    created_at     TEXT NOT NULL,
+    completed_at   TEXT,
+    results_json   TEXT,
+    next_user_id   INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS users (
+    session_id   TEXT NOT NULL REFERENCES sessions(session_id),
+    user_id      TEXT NOT NULL,
+    name         TEXT NOT NULL,
+    name_key     TEXT NOT NULL,
+    submitted_at TEXT NOT NULL,
+    prefs_json   TEXT NOT NULL,
+    PRIMARY KEY (session_id, name_key)
+);
+"""
+
+# Every Streamlit session runs on its own thread but shares one connection;
+# the lock keeps each read or read-modify-write from interleaving with another
+_DB_LOCK = threading.RLock()
+
+# Deferred writes: requests queue their database writes and return right away;
+# one background thread applies them in order.
+# _PENDING_SESSIONS holds the latest state of every session with a write still
+# in the queue, so reads see it before it reaches the database.
+_WRITE_QUEUE = queue.Queue()
+_PENDING_SESSIONS = {}
+_PENDING_LOCK = threading.RLock()
+
+# Sessions already read from the database, so reruns don't query and parse
+# them again: session_id -> (write_generation, data_version, session).
+# write_generation counts writes queued by this process for the session;
+# data_version (SQLite) changes when another process writes the database.
+# Guarded by _PENDING_LOCK.
+SESSION_CACHE_SIZE = 256
+_SESSION_CACHE = {}
+_WRITE_GENERATION = {}
+
+# One connection and one writer thread per process. Plain module globals,
+# not st.cache_resource: that cache is skipped on threads without a script
+# context and emptied by "Clear cache", and a second writer thread would
+# apply queued writes out of order.
+_connection = None
+_connection_lock = threading.Lock()
+_writer = None
+_writer_lock = threading.Lock()
+
+def get_connection():
+    """
+    Open the sessions database once per process.
+
+    Why SQLite instead of one JSON file per session?
+    - Adding a user writes one row, not the whole session file
+    - Progress checks count rows instead of parsing everything
+    - Writes are transactional, so two friends joining at once can't
+      overwrite each other's submission
+
+    WAL journal: readers don't block the writer (and vice versa);
+    synchronous=NORMAL is safe with WAL and skips an fsync per commit.
+    """
+    global _connection
+    with _connection_lock:
+        if _connection is None:
+            _connection = _open_connection()
+    return _connection
+
+def _open_connection():
+    """
+    Connect to the sessions database and make sure its tables exist.
+    """
+    conn = sqlite3.connect(SESSIONS_DB_PATH, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA foreign_keys=ON')
+    conn.executescript(SCHEMA)
+
+    if conn.execute('SELECT 1 FROM sessions LIMIT 1').fetchone() is None:
+        _import_legacy_sessions(conn)
+    return conn
+
+def _import_legacy_sessions(conn):
+    """
+    Copy sessions saved as data/sessions/session_<id>.json into a new
+    (empty) database, so share links sent before the switch keep working.
+
+    The files are left in place; they can be deleted once imported.
+    """
+    paths = sorted(glob.glob(os.path.join(LEGACY_SESSIONS_DIR, 'session_*.json')))
+    imported = 0
+    for path in paths:
+        try:
+            with open(path, 'rb') as f:
+                session_data = orjson.loads(f.read())
+            # One transaction per file: a broken file leaves nothing behind
+            with conn:
+                _write_session(conn, session_data['session_id'], session_data)
+            imported += 1
+        except (OSError, orjson.JSONDecodeError, KeyError, sqlite3.Error) as e:
+            print(f'Error importing {path}: {e}')
+    if imported:
+        print(f'Imported {imported} session(s) from {LEGACY_SESSIONS_DIR}')
+
+def _writer_loop(conn):
+    """
+    Apply queued writes one at a time, in the order they were queued.
+    """
+    while True:
+        session_id, snapshot, write, args = _WRITE_QUEUE.get()
+        try:
+            with _DB_LOCK, conn:
+                write(conn, *args)
+        except Exception as e:
+            print(f'Error saving session {session_id}: {e}')
+        finally:
+            # Stop serving the in-memory copy once the database has caught up
+            # (unless a newer write for this session is already queued)
+            with _PENDING_LOCK:
+                if _PENDING_SESSIONS.get(session_id) is snapshot:
+                    del _PENDING_SESSIONS[session_id]
+            _WRITE_QUEUE.task_done()
+
+def _start_writer():
+    """
+    Start the background writer thread, once per process.
+    """
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = threading.Thread(
+                target=_writer_loop, args=(get_connection(),),
+                name='session-writer', daemon=True
+            )
+            _writer.start()
+    return _writer
+
+def _queue_write(session_id, session_data, write, *args):
+    """
+    Make session_data what reads return for this session right away,
+    and queue write(conn, *args) to store it.
+    """
+    _start_writer()
+    with _PENDING_LOCK:
+        _PENDING_SESSIONS[session_id] = session_data
+        _WRITE_GENERATION[session_id] = _WRITE_GENERATION.get(session_id, 0) + 1
+        _SESSION_CACHE.pop(session_id, None)
+        _WRITE_QUEUE.put((session_id, session_data, write, args))
+
+def flush_writes():
+    """
+    Block until every queued write is in the database.
+    """
+    _WRITE_QUEUE.join()
+
+# Don't lose queued writes on a clean shutdown
+atexit.register(flush_writes)
 
 def load_regions():
     """
@@ -18,27 +191,28 @@ def load_regions():
 
     regions_path = os.path.join(DATA_DIR, 'regions.json')
     try:
-        with open(regions_path,'r',encoding='utf-8') as f:
-            return json.load(f)
-    except FileExistsError:
+        # Raw bytes straight into orjson (it decodes UTF-8 itself)
+        with open(regions_path,'rb') as f:
+            return orjson.loads(f.read())
+    except FileNotFoundError:
         print(f'Error: regions.json not found at {regions_path}')
         return{'regions':{}}
-    except json.JSONDecodeError as e:
+    except orjson.JSONDecodeError as e:
         print(f'Error parsing regions.json: {e}')
         return {'regions':{}}
-    
+
 def create_session(creator_name, expected_users):
     """
     Create a new trip planning session.
     Args:
         creator_name: Name of the person creating the trip
         expected_users: How many people will participate
-    
+
     Returns:
         session_id: Unique 8- character identifier
 
     """
-    session_id = str(uuid.uuid4())[:8]
+    session_id = secrets.token_hex(4)
 
 
     session_data = {
@@ -48,6 +222,8 @@ def create_session(creator_name, expected_users):
         'created_at': datetime.now().isoformat(),
         'status': 'collecting',
         'users': [],
+        'users_by_name': {},
+        'next_user_id': 0,
         'results': None
     }
 
@@ -55,75 +231,304 @@ def create_session(creator_name, expected_users):
     return session_id
 
 
+def _dump_json(data):
+    """
+    Serialize a session value (preferences, results) for the database.
+
+    orjson writes compact UTF-8 bytes straight from C; they're stored as-is
+    and orjson.loads reads them back without a decode step.
+    OPT_NON_STR_KEYS: int dict keys become strings, like the json module did.
+    """
+    return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+
+
+def _upsert_user(conn, session_id, user_data):
+    """
+    Insert a user's row, or update it if someone with the same
+    (case-insensitive) name already submitted to this session.
+    """
+    conn.execute(
+        """
+        INSERT INTO users (session_id, user_id, name, name_key, submitted_at, prefs_json)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (session_id, name_key) DO UPDATE SET
+            user_id = excluded.user_id,
+            name = excluded.name,
+            submitted_at = excluded.submitted_at,
+            prefs_json = excluded.prefs_json
+        """,
+        (
+            session_id,
+            user_data['user_id'],
+            user_data['name'],
+            user_data['name'].lower(),
+            user_data['submitted_at'],
+            _dump_json(user_data['preferences'])
+        )
+    )
+
+
+def _write_user(conn, session_id, user_data, next_user_id):
+    """
+    Store one submission and the session's advanced user id counter.
+    """
+    conn.execute(
+        'UPDATE sessions SET next_user_id = ? WHERE session_id = ?',
+        (next_user_id, session_id)
+    )
+    _upsert_user(conn, session_id, user_data)
+
+
+def _write_session(conn, session_id, session_data):
+    """
+    Write a whole session (session row + all its users) to the database.
+    Replaces whatever was stored for this session before.
+    """
+    results = session_data.get('results')
+    conn.execute(
+        """
+        INSERT INTO sessions
+            (session_id, creator, expected_users, status, created_at, completed_at, results_json,
+             next_user_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (session_id) DO UPDATE SET
+            creator = excluded.creator,
+            expected_users = excluded.expected_users,
+            status = excluded.status,
+            created_at = excluded.created_at,
+            completed_at = excluded.completed_at,
+            results_json = excluded.results_json,
+            next_user_id = excluded.next_user_id
+        """,
+        (
+            session_id,
+            session_data['creator'],
+            session_data['expected_users'],
+            session_data['status'],
+            session_data['created_at'],
+            session_data.get('completed_at'),
+            _dump_json(results) if results is not None else None,
+            session_data.get('next_user_id', len(session_data['users']))
+        )
+    )
+    conn.execute('DELETE FROM users WHERE session_id = ?', (session_id,))
+    for user in session_data['users']:
+        _upsert_user(conn, session_id, user)
+
+
+def _index_users(users):
+    """
+    {lowercased name: user} for a users list (keeps the list's order).
+
+    Kept next to session['users'] in memory so a resubmission is found
+    by a dict lookup; only the list is stored.
+    """
+    return {user['name'].lower(): user for user in users}
+
+
 def save_session(session_id, session_data):
     """
-    Save Session data to JSON File
-    Each Session gets its own file: sessions/session_abc123.json
+    Save a whole session (session row + all its users).
+    Replaces whatever was stored for this session before.
+
+    The database write happens in the background; load_session
+    sees the new data immediately.
+    """
+
+    session_data = copy.deepcopy(session_data)
+    session_data['users_by_name'] = _index_users(session_data['users'])
+    _queue_write(session_id, session_data, _write_session, session_id, session_data)
+
+
+def _read_session(session_id):
+    """
+    Read a session from the database (ignores queued writes).
+    Returns None if it isn't there.
+    """
+    conn = get_connection()
+    with _DB_LOCK:
+        row = conn.execute(
+            """
+            SELECT creator, expected_users, status, created_at, completed_at, results_json,
+                   next_user_id
+            FROM sessions WHERE session_id = ?
+            """,
+            (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        user_rows = conn.execute(
+            """
+            SELECT user_id, name, submitted_at, prefs_json
+            FROM users WHERE session_id = ? ORDER BY rowid
+            """,
+            (session_id,)
+        ).fetchall()
+
+    (creator, expected_users, status, created_at, completed_at, results_json,
+     next_user_id) = row
+    users = [
+        {
+            'name': name,
+            'preferences': orjson.loads(prefs_json),
+            'user_id': user_id,
+            'submitted_at': submitted_at
+        }
+        for user_id, name, submitted_at, prefs_json in user_rows
+    ]
+    session = {
+        'session_id': session_id,
+        'creator': creator,
+        'expected_users': expected_users,
+        'created_at': created_at,
+        'status': status,
+        'users': users,
+        'users_by_name': _index_users(users),
+        'next_user_id': next_user_id,
+        'results': orjson.loads(results_json) if results_json is not None else None
+    }
+    if completed_at is not None:
+        session['completed_at'] = completed_at
+
+    return session
+
+
+def _data_version():
+    """
+    SQLite's counter of changes made by OTHER connections (processes).
+    """
+    conn = get_connection()
+    with _DB_LOCK:
+        return conn.execute('PRAGMA data_version').fetchone()[0]
+
+
+def _known_session(session_id):
+    """
+    Latest state of a session without reading it from the database:
+    its queued write, or a still-valid cached read.
+
+    Returns: (session or None, write_generation)
     """
+    with _PENDING_LOCK:
+        pending = _PENDING_SESSIONS.get(session_id)
+        if pending is not None:
+            return pending, None
 
-    session_path = os.path.join(SESSIONS_DIR, f"session_{session_id}.json")
-    with open(session_path, 'w',encoding='utf-8') as f:
-        json.dump(session_data,f , indent=2,ensure_ascii=False)
+        generation = _WRITE_GENERATION.get(session_id, 0)
+        cached = _SESSION_CACHE.get(session_id)
+
+    if cached is not None:
+        cached_generation, cached_version, session = cached
+        if cached_generation == generation and cached_version == _data_version():
+            return session, generation
+
+    return None, generation
 
 
 def load_session(session_id):
     """
     Load an existing session by ID.
     Returns none if session doesnot exist.
+
+    Served from memory when possible; the returned dict is shared,
+    so treat it as read-only (save changes with save_session).
     """
 
-    session_path = os.path.join(SESSIONS_DIR,f'session_{session_id}.json')
-    try:
-        with open(session_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return None
+    session, generation = _known_session(session_id)
+    if session is not None:
+        return session
+
+    data_version = _data_version()
+    session = _read_session(session_id)
+
+    with _PENDING_LOCK:
+        # Only cache it if no write for this session was queued meanwhile
+        if session is not None and _WRITE_GENERATION.get(session_id, 0) == generation:
+            _SESSION_CACHE.pop(session_id, None)
+            _SESSION_CACHE[session_id] = (generation, data_version, session)
+            if len(_SESSION_CACHE) > SESSION_CACHE_SIZE:
+                # Dicts keep insertion order: drop the least recently read
+                del _SESSION_CACHE[next(iter(_SESSION_CACHE))]
+
+    return session
 
 
 def add_user_to_session(session_id, user_data):
     """
     Add a user's preferences to a session
 
-    Args: 
-        session_id: The session to add to 
+    Args:
+        session_id: The session to add to
         user_data: Dict containing user's name and preferences
 
     Returns:
         True if successful , False if session not found
     """
 
-    session = load_session(session_id)
-    if not session:
-        return False
-    user_data['user_id'] = str(uuid.uuid4())[:8]
     user_data['submitted_at'] = datetime.now().isoformat()
 
-    existing_user_index = None
-    for i , user in enumerate(session['users']):
-        if user['name'].lower() == user_data['name'].lower():
-            existing_user_index = i
-            break
-    if existing_user_index is not None:
-        session['users'][existing_user_index] = user_data
-    else:
-        session['users'].append(user_data)
-    
-
-    save_session(session_id,session)
+    # Read-modify-queue under the lock so two joiners can't both
+    # start from the same state and drop each other from it
+    with _PENDING_LOCK:
+        session = load_session(session_id)
+        if not session:
+            return False
+
+        # Shared dict: change a copy
+        session = dict(session)
+
+        # Ids only need to be unique within the session: u0000, u0001, ...
+        user_data['user_id'] = f"u{session['next_user_id']:04d}"
+        session['next_user_id'] += 1
+        user_data = copy.deepcopy(user_data)
+
+        # Same name again = update their preferences, not a new user
+        # (replacing a dict value keeps its position)
+        users_by_name = dict(session['users_by_name'])
+        users_by_name[user_data['name'].lower()] = user_data
+        session['users_by_name'] = users_by_name
+        session['users'] = list(users_by_name.values())
+
+        _queue_write(session_id, session, _write_user, session_id, user_data,
+                     session['next_user_id'])
+
     return True
 
+def progress_from_session(session):
+    """
+    Same as get_session_progress, for a session that's already loaded.
+    Returns: (submitted_count, expected_count, user_names)
+    """
+    names = [user['name'] for user in session['users']]
+    return (len(names), session['expected_users'], names)
+
 def get_session_progress(session_id):
     """
     Get how many users have submitted vs expected.
     Returns: (submitted_count, expected_count, user_names)
     """
-    session = load_session(session_id)
-    if not session:
+    session, _ = _known_session(session_id)
+    if session is not None:
+        return progress_from_session(session)
+
+    conn = get_connection()
+    with _DB_LOCK:
+        rows = conn.execute(
+            """
+            SELECT s.expected_users, u.name
+            FROM sessions s LEFT JOIN users u ON u.session_id = s.session_id
+            WHERE s.session_id = ?
+            ORDER BY u.rowid
+            """,
+            (session_id,)
+        ).fetchall()
+    if not rows:
         return (0, 0, [])
-    
-    submitted = len(session['users'])
-    expected = session['expected_users']  # ✅ Fixed!
-    names = [user['name'] for user in session['users']]
+
+    expected = rows[0][0]
+    names = [name for _, name in rows if name is not None]
+    submitted = len(names)
 
     return (submitted, expected, names)
 
@@ -136,15 +541,35 @@ def mark_session_complete(session_id, results):
         results: Generated itinerary options
     """
 
-    session = load_session(session_id)
-    if not session:
-        return False
-    
-    session['status'] = 'completed'
-    session['results'] = results
-    session['completed_at'] = datetime.now().isoformat()
+    with _PENDING_LOCK:
+        session = load_session(session_id)
+        if not session:
+            return False
+
+        session = dict(session)
+        session['status'] = 'completed'
+        session['results'] = copy.deepcopy(results)
+        session['completed_at'] = datetime.now().isoformat()
 
+        _queue_write(session_id, session, _write_completion, session_id, session)
 
-    save_session(session_id,session)
     return True
 
+
+def _write_completion(conn, session_id, session_data):
+    """
+    Store a finished session's status, results and completion time.
+    """
+    conn.execute(
+        """
+        UPDATE sessions
+        SET status = ?, results_json = ?, completed_at = ?
+        WHERE session_id = ?
+        """,
+        (
+            session_data['status'],
+            _dump_json(session_data['results']),
+            session_data['completed_at'],
+            session_id
+        )
+    )